@@ -1,7 +1,13 @@
 import streamlit as st
+import datetime
+import posixpath
+import zipfile
 from io import BytesIO
+from itertools import islice, zip_longest
+from xml.etree import ElementTree
+import numpy as np
 import pandas as pd
-from openpyxl import load_workbook
+from python_calamine import CalamineWorkbook, SheetTypeEnum
 
 # ========= CONFIG: HEADER COLOURS (MATCHING YOUR SCREENSHOT) =========
 # A: green, B: dark blue, C: yellow, D: light blue, F: red, H: orange, I: grey
@@ -27,120 +33,296 @@ SHELF_COLORS = {
 
 SHELF_ORDER = list("ABCDEFGHIJKLMNO") + ["Others"]
 
+# Cached uploads/outputs kept in server memory: the last few files, for
+# an hour at most
+CACHE_MAX_ENTRIES = 4
+CACHE_TTL_SECONDS = 60 * 60
 
-# ========= HELPERS =========
-
-def detect_shelf(label: str) -> str:
-    """
-    Shelf is digit number 9 in the label ID.
-    Example: HAZ-A101I123 -> 9th char = 'I' -> shelf I.
-    Anything not A–O goes to Others.
-    """
-    if label is None:
-        return "Others"
-
-    text = str(label).strip()
-    if len(text) < 9:
-        return "Others"
+# Lower-cases just the letters of "bin", for the case-insensitive filter
+_BIN_CASE = str.maketrans("BIN", "bin")
 
-    ch = text[8].upper()  # 0-based index → 9th character
+# XML namespaces / tags used when reading colours straight from the xlsx
+_MAIN_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_DOC_REL_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+_PKG_REL_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+_ROW_TAG = _MAIN_NS + "row"
+_CELL_TAG = _MAIN_NS + "c"
 
-    if ch in SHELF_ORDER[:-1]:  # A–O
-        return ch
-    return "Others"
 
+# ========= HELPERS =========
 
-def get_cell_color_hex(cell):
+def fill_color_hex(fill):
     """
-    Get cell background colour as #RRGGBB.
+    Get the background colour of a <fill> (from styles.xml) as #RRGGBB.
 
     - If we have an explicit RGB (most manual fills), use it.
     - If it's theme/indexed but has a visible fill, we fall back
       to a default baby blue (#61CBF3) instead of white.
     """
-    fill = cell.fill
-    if not fill or getattr(fill, "patternType", None) in (None, "none"):
+    pattern = fill.find(_MAIN_NS + "patternFill")
+    if pattern is None:  # gradient fill
         return None
-
-    # Prefer fgColor, fall back to start_color
-    color_obj = getattr(fill, "fgColor", None) or getattr(fill, "start_color", None)
-    if not color_obj:
+    if pattern.get("patternType") in (None, "none"):
         return None
 
-    ctype = getattr(color_obj, "type", None)
-    rgb = getattr(color_obj, "rgb", None)
-
-    # Direct RGB (e.g. "FFRRGGBB")
-    if ctype == "rgb" and rgb:
-        if len(rgb) == 8:  # ARGB
-            rgb = rgb[2:]
-        if len(rgb) == 6:
-            return "#" + rgb.upper()
+    fg = pattern.find(_MAIN_NS + "fgColor")
+    attrs = fg.attrib if fg is not None else {}
 
     # Theme/indexed colours – treat as baby blue so they aren't white
-    if ctype in ("theme", "indexed"):
+    if "indexed" in attrs or "theme" in attrs:
         return "#61CBF3"  # fallback baby blue
+    if "auto" in attrs:
+        return None
 
+    # Direct RGB (e.g. "FFRRGGBB"); no fgColor at all means black
+    rgb = attrs.get("rgb", "00000000")
+    if len(rgb) in (6, 8):
+        return "#" + rgb[-6:].upper()
     return None
 
 
-def process_sheet(ws):
+def _rel_targets(zf, part):
+    """
+    { relationship id -> (type, part path) } for a part of the xlsx zip
+    ("" for the package itself), from its _rels file.
+    """
+    folder, name = posixpath.split(part)
+    rels_path = posixpath.join(folder, "_rels", name + ".rels")
+    try:
+        root = ElementTree.parse(zf.open(rels_path)).getroot()
+    except KeyError:  # part has no relationships
+        return {}
+
+    targets = {}
+    for rel in root.iter(_PKG_REL_NS + "Relationship"):
+        target = rel.get("Target")
+        if target.startswith("/"):
+            path = target[1:]
+        else:
+            path = posixpath.normpath(posixpath.join(folder, target))
+        targets[rel.get("Id")] = (rel.get("Type"), path)
+    return targets
+
+
+def workbook_style_colors(zf):
+    """
+    Read an xlsx zip's workbook.xml and styles.xml once.
+
+    Returns:
+      sheet_paths : { sheet_name -> path of its XML part in the zip }
+      style_colors: colour (see fill_color_hex) for each cell style id,
+                    i.e. the s="..." attribute of a cell
+    """
+    workbook_path = next(
+        path
+        for rel_type, path in _rel_targets(zf, "").values()
+        if rel_type.endswith("/officeDocument")
+    )
+    rels = _rel_targets(zf, workbook_path)
+
+    root = ElementTree.parse(zf.open(workbook_path)).getroot()
+    sheet_paths = {
+        sheet.get("name"): rels[sheet.get(_DOC_REL_NS + "id")][1]
+        for sheet in root.iter(_MAIN_NS + "sheet")
+    }
+
+    styles_path = next(
+        (path for rel_type, path in rels.values() if rel_type.endswith("/styles")),
+        None,
+    )
+    if styles_path is None:
+        return sheet_paths, []
+
+    root = ElementTree.parse(zf.open(styles_path)).getroot()
+    fills = root.find(_MAIN_NS + "fills")
+    fill_colors = [fill_color_hex(fill) for fill in fills] if fills is not None else []
+
+    # Each cell style (xf) points at one of the fills above
+    style_colors = []
+    xfs = root.find(_MAIN_NS + "cellXfs")
+    for xf in xfs if xfs is not None else ():
+        fill_id = int(xf.get("fillId", 0))
+        in_range = fill_id < len(fill_colors)
+        style_colors.append(fill_colors[fill_id] if in_range else None)
+    return sheet_paths, style_colors
+
+
+def _column_index(ref):
+    """1-based column number of a cell reference, e.g. "AB12" -> 28."""
+    col = 0
+    for ch in ref:
+        if ch.isdigit():
+            break
+        col = col * 26 + ord(ch) - 64
+    return col
+
+
+def process_sheet(rows):
     """
-    Read a single worksheet.
+    Read a single worksheet, given as rows of cell values from A1 (as
+    returned by calamine: same-width rows, "" for empty cells).
     - All non-empty cells are labels.
     - Exclude any label that contains 'bin' (case-insensitive).
     - Shelves A–O: just text.
-    - Others: keep text + source cell colour.
+    - Others: keep text + where it came from, so its colour can be
+      looked up afterwards (see read_workbook).
 
     Returns:
-      df_out       : DataFrame with columns A–O + Others
-      others_colors: list of colours for the Others column (same length as column)
+      groups      : { shelf -> list of labels } for A–O + Others
+      others_cells: (row, column) of each Others label in the source sheet
     """
-    groups = {shelf: [] for shelf in SHELF_ORDER}
-    others_colors = []
-
-    for row in ws.iter_rows():
-        for cell in row:
-            val = cell.value
-            if val is None:
-                continue
-
-            text = str(val).strip()
-            if not text:
-                continue
-
-            # Exclude labels that include the word "bin" (any case)
-            if "bin" in text.lower():
-                continue
-
-            shelf = detect_shelf(text)
-            if shelf == "Others":
-                groups["Others"].append(text)
-                others_colors.append(get_cell_color_hex(cell))
-            else:
-                groups[shelf].append(text)
+    # calamine rows are all the same width, so this is one 2-D grid (an
+    # empty sheet comes back as [], hence atleast_2d)
+    grid = np.atleast_2d(np.array(rows, dtype=object))
+    row_idx, col_idx = np.nonzero(grid != "")
+    vals = grid[row_idx, col_idx]  # row by row, left to right
+
+    # calamine reads whole numbers as floats; turn them back into ints, but
+    # keep huge ones as floats (1e+20, not 100000000000000000000). Date-only
+    # cells come back as dates; show them as datetimes like openpyxl did.
+    for i in np.flatnonzero([type(v) in (float, datetime.date) for v in vals]):
+        v = vals[i]
+        if type(v) is datetime.date:
+            vals[i] = datetime.datetime.combine(v, datetime.time())
+        elif v.is_integer() and abs(v) < 1e16:
+            vals[i] = int(v)
+
+    # Classify every label in one go. Strip and filter as variable-length
+    # strings: a fixed-width array would be as wide as the longest cell.
+    s = pd.Series(vals, dtype=object).astype(str).str.strip()
+
+    # Drop empty labels and those that include the word "bin" (any case)
+    has_bin = s.str.translate(_BIN_CASE).str.contains("bin", regex=False)
+    keep = ((s != "") & ~has_bin).to_numpy(dtype=bool)
+    texts = s.to_numpy(dtype=object)
+
+    # Shelf is the 9th character of the label ID (HAZ-A101I123 -> I);
+    # anything not A–O, or too short to have one, goes to Others. Read it
+    # from a fixed-width view of just the first 9 characters. upper() can
+    # turn one character into several, so widen first rather than truncate.
+    prefix = s.str[:9].to_numpy(dtype=object).astype("U9")
+    ninth = prefix.view("U1").reshape(-1, 9)[:, 8]
+    ninth = np.char.upper(ninth.astype("U3"))
+
+    letters = np.array(SHELF_ORDER[:-1])  # A–O, sorted
+    shelf_idx = np.searchsorted(letters, ninth)
+    is_shelf = letters[np.minimum(shelf_idx, len(letters) - 1)] == ninth
+    shelf_idx[~is_shelf] = len(letters)  # Others
+
+    # Bucket the kept labels by shelf with one stable sort (labels keep
+    # their sheet order within a shelf) instead of one mask per shelf
+    kept_idx = shelf_idx[keep].astype(np.uint8)
+    order = np.argsort(kept_idx, kind="stable")
+    bounds = np.cumsum(np.bincount(kept_idx, minlength=len(SHELF_ORDER)))[:-1]
+    buckets = np.split(texts[keep][order], bounds)
+    groups = {shelf: bucket.tolist() for shelf, bucket in zip(SHELF_ORDER, buckets)}
+    others = keep & ~is_shelf
+    others_cells = list(
+        zip((row_idx[others] + 1).tolist(), (col_idx[others] + 1).tolist())
+    )
+    return groups, others_cells
+
+
+def preview_layout(groups, n_rows=20):
+    """
+    First n_rows of the shelf layout as a DataFrame (A–O + Others),
+    shorter columns padded with "". Only used for the on-screen preview.
+    """
+    columns = [groups[shelf] for shelf in SHELF_ORDER]
+    rows = islice(zip_longest(*columns, fillvalue=""), n_rows)
+    return pd.DataFrame(list(rows), columns=SHELF_ORDER)
+
+
+def lookup_cell_colors(sheet_xml, cells, style_colors):
+    """
+    Colour of each (row, column) in cells, which must be in row order.
+
+    The sheet XML is streamed and only the style id (s="...") of the
+    wanted cells is read: no cell values, no per-cell objects. Parsing
+    stops after the last wanted row.
+    """
+    wanted = set(cells)
+    last_row = cells[-1][0]
+
+    colors = {}
+    row_idx = col_idx = 0
+    for event, el in ElementTree.iterparse(sheet_xml, events=("start", "end")):
+        if event == "end":
+            if el.tag == _ROW_TAG:
+                el.clear()  # done with this row's cells
+            continue
+
+        if el.tag == _ROW_TAG:
+            row_idx = int(el.get("r", row_idx + 1))
+            if row_idx > last_row:
+                break
+            col_idx = 0
+        elif el.tag == _CELL_TAG:
+            ref = el.get("r")
+            col_idx = _column_index(ref) if ref else col_idx + 1
+            if (row_idx, col_idx) in wanted:
+                style_id = int(el.get("s", 0))
+                if style_id < len(style_colors):
+                    colors[row_idx, col_idx] = style_colors[style_id]
+
+    return [colors.get(cell) for cell in cells]
+
+
+@st.cache_data(
+    show_spinner=False, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL_SECONDS
+)
+def read_workbook(file_bytes):
+    """
+    Process every sheet of the uploaded workbook (given as raw bytes, so
+    Streamlit can cache the result per file).
 
-    # Determine max column length
-    max_len = max((len(v) for v in groups.values()), default=0)
+    Values are read with calamine, which doesn't build a Python object per
+    cell. Colours are only needed for labels that landed in Others: for
+    those, styles.xml is read once and just those cells' style ids are
+    picked out of the sheet XML.
 
-    data = {}
-    padded_others_colors = list(others_colors)
-    for shelf in SHELF_ORDER:
-        col_vals = groups[shelf]
-        pad = max_len - len(col_vals)
-        if pad > 0:
-            col_vals = col_vals + [""] * pad
-            if shelf == "Others":
-                padded_others_colors = padded_others_colors + [None] * pad
-        data[shelf] = col_vals
+    Returns:
+      { sheet_name -> (groups, others_colors) }, others_colors lined up
+      with groups["Others"].
+    """
+    wb = CalamineWorkbook.from_filelike(BytesIO(file_bytes))
+    sheet_names = [
+        sheet.name
+        for sheet in wb.sheets_metadata
+        if sheet.typ == SheetTypeEnum.WorkSheet  # chart sheets have no cells
+    ]
+
+    # One sheet at a time, so only one sheet's rows are held in memory
+    scanned = {
+        name: process_sheet(
+            wb.get_sheet_by_name(name).to_python(skip_empty_area=False)
+        )
+        for name in sheet_names
+    }
+    wb.close()
+
+    sheets_data = {name: (groups, []) for name, (groups, _) in scanned.items()}
+    if any(others_cells for _, others_cells in scanned.values()):
+        with zipfile.ZipFile(BytesIO(file_bytes)) as zf:
+            sheet_paths, style_colors = workbook_style_colors(zf)
+            for sheet_name, (groups, others_cells) in scanned.items():
+                if not others_cells:
+                    continue
+                with zf.open(sheet_paths[sheet_name]) as sheet_xml:
+                    others_colors = lookup_cell_colors(
+                        sheet_xml, others_cells, style_colors
+                    )
+                sheets_data[sheet_name] = (groups, others_colors)
 
-    df_out = pd.DataFrame(data)
-    return df_out, padded_others_colors
+    return sheets_data
 
 
+@st.cache_data(
+    show_spinner=False, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL_SECONDS
+)
 def write_output_workbook(sheets_data):
     """
-    sheets_data: { sheet_name -> (df_out, others_colors) }
+    sheets_data: { sheet_name -> (groups, others_colors) }
 
     For each sheet:
       - Row 1: colour hex (if defined in SHELF_COLORS) + same bg colour.
@@ -151,53 +333,69 @@ def write_output_workbook(sheets_data):
     from pandas import ExcelWriter
 
     output = BytesIO()
-    with ExcelWriter(output, engine="xlsxwriter") as writer:
+    options = {
+        # Stream rows to disk instead of keeping the whole sheet in memory
+        "constant_memory": True,
+        # Labels are plain text; don't let xlsxwriter reinterpret them
+        "strings_to_numbers": False,
+        "strings_to_formulas": False,
+        "strings_to_urls": False,
+    }
+    with ExcelWriter(
+        output, engine="xlsxwriter", engine_kwargs={"options": options}
+    ) as writer:
         workbook = writer.book
 
         others_col_idx = SHELF_ORDER.index("Others")
 
-        for sheet_name, (df_out, others_colors) in sheets_data.items():
-            # Write data WITHOUT headers, starting row 2 (Excel row 3)
-            df_out.to_excel(
-                writer,
-                sheet_name=sheet_name,
-                index=False,
-                header=False,
-                startrow=2,
+        # Formats are shared by all sheets, and by shelves with the same
+        # header colour, so create one pair per distinct colour up front
+        row1_fmts = {}  # Row 1: colour hex
+        row2_fmts = {}  # Row 2: shelf letter
+        header_colors = [SHELF_COLORS.get(shelf) for shelf in SHELF_ORDER]
+        for header_color in dict.fromkeys(header_colors):
+            bg = {"bg_color": header_color} if header_color else {}
+            row1_fmts[header_color] = workbook.add_format(
+                {"align": "center", "valign": "vcenter", "border": 1, **bg}
+            )
+            row2_fmts[header_color] = workbook.add_format(
+                {"bold": True, "align": "center", "valign": "vcenter", "border": 1, **bg}
             )
 
-            ws = writer.sheets[sheet_name]
-
-            # Header rows
-            for col_idx, shelf in enumerate(SHELF_ORDER):
-                header_color = SHELF_COLORS.get(shelf)
-
-                # Row 1: colour hex
-                row1_fmt = workbook.add_format(
-                    {"align": "center", "valign": "vcenter", "border": 1}
-                )
-                # Row 2: shelf letter
-                row2_fmt = workbook.add_format(
-                    {"bold": True, "align": "center", "valign": "vcenter", "border": 1}
-                )
+        # Others cell formats, created on first use of each colour
+        others_fmts = {}
 
-                if header_color:
-                    row1_fmt.set_bg_color(header_color)
-                    row2_fmt.set_bg_color(header_color)
-                    ws.write(0, col_idx, header_color, row1_fmt)
-                else:
-                    ws.write(0, col_idx, "", row1_fmt)
+        for sheet_name, (groups, others_colors) in sheets_data.items():
+            ws = workbook.add_worksheet(sheet_name)
 
-                ws.write(1, col_idx, shelf, row2_fmt)
+            # constant_memory mode flushes each row once the next one is
+            # started, so everything has to be written strictly top-down.
 
-            # Apply original colours to Others column cells (row 3+)
-            for i, color_hex in enumerate(others_colors):
-                if not color_hex:
+            # Header rows
+            for col_idx, header_color in enumerate(header_colors):
+                ws.write(0, col_idx, header_color or "", row1_fmts[header_color])
+            for col_idx, (shelf, header_color) in enumerate(zip(SHELF_ORDER, header_colors)):
+                ws.write(1, col_idx, shelf, row2_fmts[header_color])
+
+            # Labels from row 3; Others cells get their original colours.
+            # Shorter columns just run out (None), leave those cells out.
+            columns = [groups[shelf] for shelf in SHELF_ORDER]
+            rows = zip_longest(*columns, others_colors)
+            for r, (*row, color_hex) in enumerate(rows, start=2):
+                for col_idx, value in enumerate(row[:others_col_idx]):
+                    if value is not None:
+                        ws.write_string(r, col_idx, value)
+
+                value = row[others_col_idx]
+                if value is None:
                     continue
-                value = df_out.iloc[i, others_col_idx]
-                cell_fmt = workbook.add_format({"border": 1})
-                cell_fmt.set_bg_color(color_hex)
-                ws.write(2 + i, others_col_idx, value, cell_fmt)
+                cell_fmt = None
+                if color_hex:
+                    cell_fmt = others_fmts.get(color_hex)
+                    if cell_fmt is None:
+                        cell_fmt = workbook.add_format({"border": 1, "bg_color": color_hex})
+                        others_fmts[color_hex] = cell_fmt
+                ws.write_string(r, others_col_idx, value, cell_fmt)
 
             # Nice column width
             ws.set_column(0, len(SHELF_ORDER) - 1, 22)
@@ -216,6 +414,7 @@ Upload an **Excel file (.xlsx)** with bin label IDs.
 
 For **each sheet** in the file:
 - All non-empty cells are treated as label IDs.
+- Error cells (e.g. **#N/A**, **#DIV/0!**) are skipped.
 - Any label containing the word **"bin"** (any case) is **excluded**.
 - Shelf is from **digit 9** of the label.
 - Labels go into columns **A–O** or **Others**.
@@ -238,23 +437,18 @@ if generate:
         st.error("Please upload an Excel (.xlsx) file first.")
     else:
         try:
-            wb = load_workbook(uploaded_file, data_only=True)
+            sheets_data = read_workbook(uploaded_file.getvalue())
         except Exception as e:
             st.error(f"Failed to read Excel file: {e}")
         else:
-            sheets_data = {}
-            for ws in wb.worksheets:
-                df_out, others_colors = process_sheet(ws)
-                sheets_data[ws.title] = (df_out, others_colors)
-
             if not sheets_data:
                 st.error("No data found in the uploaded workbook.")
             else:
                 # Preview first sheet
                 first_name = next(iter(sheets_data.keys()))
-                preview_df, _ = sheets_data[first_name]
+                groups, _ = sheets_data[first_name]
                 st.write(f"Preview from sheet: **{first_name}**")
-                st.dataframe(preview_df.head(20))
+                st.dataframe(preview_layout(groups))
 
                 excel_bytes = write_output_workbook(sheets_data)
                 st.success("Shelf layout Excel generated successfully.")
@@ -0,0 +1,198 @@
+import datetime
+import zipfile
+from io import BytesIO
+
+import xlsxwriter
+from python_calamine import CalamineWorkbook
+from xlsxwriter.color import Color
+
+import app
+
+
+def test_process_sheet_long_cell():
+    # One long note among many labels must not blow up a fixed-width
+    # array to (labels x longest cell)
+    note = "-" * 20_000
+    rows = [[f"HAZ-A101{'ABP'[i % 3]}{i:06d}"] for i in range(200_000)]
+    rows[1][0] = note
+
+    groups, others_cells = app.process_sheet(rows)
+
+    assert len(groups["A"]) == 66_667
+    assert len(groups["B"]) == 66_666
+    assert groups["Others"][0] == note
+    assert others_cells[0] == (2, 1)
+    assert len(groups["Others"]) == len(others_cells) == 66_667
+
+
+def test_process_sheet_number_and_date_text():
+    # Numbers and dates read as text the same way openpyxl showed them
+    rows = [[12.0, 1e20, 1e16, 9999999999999998.0, datetime.date(2024, 1, 2), 1.5]]
+
+    groups, _ = app.process_sheet(rows)
+
+    assert groups["Others"] == [
+        "12", "1e+20", "1e+16", "9999999999999998", "2024-01-02 00:00:00", "1.5",
+    ]
+
+
+def _patched_xlsx(build, replace):
+    """Build an xlsx with xlsxwriter, then patch its styles.xml."""
+    out = BytesIO()
+    wb = xlsxwriter.Workbook(out)
+    build(wb)
+    wb.close()
+
+    patched = BytesIO()
+    with zipfile.ZipFile(out) as src, zipfile.ZipFile(patched, "w") as dst:
+        for item in src.infolist():
+            data = src.read(item)
+            if item.filename == "xl/styles.xml":
+                text = data.decode()
+                for old, new in replace.items():
+                    assert old in text
+                    text = text.replace(old, new)
+                data = text.encode()
+            dst.writestr(item, data)
+    return patched.getvalue()
+
+
+def test_read_workbook_others_colors():
+    def build(wb):
+        fmt = {
+            "rgb": wb.add_format({"bg_color": "#FF0000"}),
+            "theme": wb.add_format({"bg_color": Color.theme(4, 0)}),
+            # xlsxwriter can't write these two: patched into styles.xml below
+            "indexed": wb.add_format({"bg_color": "#0000FE"}),
+            "gradient": wb.add_format({"bg_color": "#0000FD"}),
+            "none": wb.add_format({"bold": True}),  # styled, but fill 0
+            "no fg": wb.add_format({"bg_color": Color.automatic()}),
+            "far": wb.add_format({"bg_color": "#123456"}),
+        }
+        ws = wb.add_worksheet("Main")
+        ws.write_string("A1", "HAZ-A101A001")
+        for col, name in enumerate(["rgb", "theme", "indexed", "gradient", "none", "no fg"], 2):
+            ws.write_string(4, col, name, fmt[name])  # C5 onwards
+        ws.write_string(4, 8, "plain")
+        ws.write_string("AB100", "far", fmt["far"])
+
+        ws = wb.add_worksheet("Second")
+        ws.write_string("A1", "HAZ-A101B001", fmt["rgb"])
+        ws.write_string("B2", "other", wb.add_format({"bg_color": "#00B050"}))
+
+    data = _patched_xlsx(build, {
+        '<fgColor rgb="FF0000FE"/>': '<fgColor indexed="10"/>',
+        '<patternFill patternType="solid"><fgColor rgb="FF0000FD"/><bgColor indexed="64"/></patternFill>': (
+            '<gradientFill degree="90"><stop position="0"><color rgb="FF0000FD"/></stop>'
+            '<stop position="1"><color theme="4"/></stop></gradientFill>'
+        ),
+    })
+
+    sheets = app.read_workbook.__wrapped__(data)
+
+    groups, others_colors = sheets["Main"]
+    assert groups["A"] == ["HAZ-A101A001"]
+    assert groups["Others"] == [
+        "rgb", "theme", "indexed", "gradient", "none", "no fg", "plain", "far",
+    ]
+    assert others_colors == [
+        "#FF0000", "#61CBF3", "#61CBF3", None, None, "#000000", None, "#123456",
+    ]
+
+    groups, others_colors = sheets["Second"]
+    assert groups["B"] == ["HAZ-A101B001"]
+    assert groups["Others"] == ["other"]
+    assert others_colors == ["#00B050"]
+
+
+def test_read_workbook_cells_without_refs():
+    # <row>/<c> may leave out r=: positions then follow document order
+    def cell(text, style=0):
+        return f'<c s="{style}" t="inlineStr"><is><t>{text}</t></is></c>'
+
+    main_ns = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+    doc_rels = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+    parts = {
+        "[Content_Types].xml": (
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+            '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+            "</Types>"
+        ),
+        "_rels/.rels": (
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            f'<Relationship Id="rId1" Type="{doc_rels}/officeDocument" Target="xl/workbook.xml"/>'
+            "</Relationships>"
+        ),
+        "xl/workbook.xml": (
+            f'<workbook xmlns="{main_ns}" xmlns:r="{doc_rels}">'
+            '<sheets><sheet name="Sheet1" sheetId="1" r:id="rId1"/></sheets></workbook>'
+        ),
+        "xl/_rels/workbook.xml.rels": (
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            f'<Relationship Id="rId1" Type="{doc_rels}/worksheet" Target="worksheets/sheet1.xml"/>'
+            f'<Relationship Id="rId2" Type="{doc_rels}/styles" Target="styles.xml"/>'
+            "</Relationships>"
+        ),
+        "xl/styles.xml": (
+            f'<styleSheet xmlns="{main_ns}">'
+            '<fills count="3"><fill><patternFill patternType="none"/></fill>'
+            '<fill><patternFill patternType="gray125"/></fill>'
+            '<fill><patternFill patternType="solid"><fgColor rgb="FFFF0000"/></patternFill></fill></fills>'
+            '<cellXfs count="2"><xf fillId="0"/><xf fillId="2"/></cellXfs></styleSheet>'
+        ),
+        "xl/worksheets/sheet1.xml": (
+            f'<worksheet xmlns="{main_ns}"><sheetData>'
+            f'<row>{cell("HAZ-A101A001")}{cell("red", 1)}</row>'
+            f'<row>{cell("plain")}{cell("two", 1)}</row>'
+            "</sheetData></worksheet>"
+        ),
+    }
+    out = BytesIO()
+    with zipfile.ZipFile(out, "w") as zf:
+        for name, xml in parts.items():
+            zf.writestr(name, xml)
+
+    groups, others_colors = app.read_workbook.__wrapped__(out.getvalue())["Sheet1"]
+
+    assert groups["A"] == ["HAZ-A101A001"]
+    assert groups["Others"] == ["red", "plain", "two"]
+    assert others_colors == ["#FF0000", None, "#FF0000"]
+
+
+def test_write_output_workbook_round_trip():
+    # constant_memory drops any write to an earlier row without an error,
+    # so read everything back
+    others_col = len(app.SHELF_ORDER)  # 1-based
+    sheets_data = {}
+    for name, n in [("First", 3), ("Second", 1)]:
+        groups = {shelf: [] for shelf in app.SHELF_ORDER}
+        groups["A"] = [f"HAZ-A101A{i:03d}" for i in range(n)]
+        groups["C"] = ["HAZ-A101C000"]
+        groups["O"] = [f"HAZ-A101O{i:03d}" for i in range(n + 2)]
+        groups["Others"] = ["red", "plain", "red again", "green"][:n + 1]
+        others_colors = ["#FF0000", None, "#FF0000", "#00B050"][:n + 1]
+        sheets_data[name] = (groups, others_colors)
+
+    data = app.write_output_workbook.__wrapped__(sheets_data)
+
+    wb = CalamineWorkbook.from_filelike(BytesIO(data))
+    with zipfile.ZipFile(BytesIO(data)) as zf:
+        sheet_paths, style_colors = app.workbook_style_colors(zf)
+        for name, (groups, others_colors) in sheets_data.items():
+            rows = wb.get_sheet_by_name(name).to_python(skip_empty_area=False)
+
+            assert rows[0] == [app.SHELF_COLORS[shelf] or "" for shelf in app.SHELF_ORDER]
+            assert rows[1] == app.SHELF_ORDER
+            columns = [[row[c] for row in rows[2:]] for c in range(others_col)]
+            for shelf, column in zip(app.SHELF_ORDER, columns):
+                labels = groups[shelf]
+                assert column == labels + [""] * (len(column) - len(labels))
+
+            cells = [(r, others_col) for r in range(3, 3 + len(groups["Others"]))]
+            with zf.open(sheet_paths[name]) as sheet_xml:
+                colors = app.lookup_cell_colors(sheet_xml, cells, style_colors)
+            assert colors == others_colors